@@ -39,9 +39,9 @@ export ROS_PACKAGE_PATH="$builddir/src/$_pkgname"
 export ROS_PYTHON_VERSION=@ros_python_version
 @[if is_ros2]@
 export PYTHON_VERSION=$(python3 -c 'import sys; print("%i.%i" % (sys.version_info.major, sys.version_info.minor))')
-if [ ! -f /usr/ros/@(ros_distro)/setup.sh ]; then
-  export PYTHONPATH=/usr/ros/@(ros_distro)/lib/python${PYTHON_VERSION}/site-packages:$PYTHONPATH
-  export AMENT_PREFIX_PATH=/usr/ros/@(ros_distro)
+if [ ! -f @(install_space)/setup.sh ]; then
+  export PYTHONPATH=@(install_space)/lib/python${PYTHON_VERSION}/site-packages:$PYTHONPATH
+  export AMENT_PREFIX_PATH=@(install_space)
 fi
 @[end if]@
 @[if rosinstall is not None]@
@@ -100,20 +100,20 @@ build() {
     fi
   done
 @[  end if]@
-  source /usr/ros/@(ros_distro)/setup.sh
+  source @(install_space)/setup.sh
   catkin_make_isolated \
     -DCMAKE_BUILD_TYPE=RelWithDebInfo 2>&1 | tee $buildlog
 @[end if]@
 @[if is_ros2]@
-  if [ -f /usr/ros/@(ros_distro)/setup.sh ]; then
-    source /usr/ros/@(ros_distro)/setup.sh
+  if [ -f @(install_space)/setup.sh ]; then
+    source @(install_space)/setup.sh
   fi
 @[end if]@
-@[if use_cmake or use_ament_cmake]@
+@[if use_any_cmake]@
   mkdir build
   cd build
   cmake ../src/$_pkgname \
-    -DCMAKE_INSTALL_PREFIX=/usr/ros/@(ros_distro) \
+    -DCMAKE_INSTALL_PREFIX=@(install_space) \
     -DCMAKE_BUILD_TYPE=RelWithDebInfo \
     -DCMAKE_INSTALL_LIBDIR=lib 2>&1 | tee $buildlog
   make 2>&1 | tee -a $buildlog
@@ -146,7 +146,7 @@ check() {
     export ROS_LOG_DIR="$logdir"
   fi
 
-  source /usr/ros/@(ros_distro)/setup.sh
+  source @(install_space)/setup.sh
   source devel_isolated/setup.sh
   catkin_make_isolated \
     -DCMAKE_BUILD_TYPE=RelWithDebInfo \
@@ -154,18 +154,18 @@ check() {
   catkin_test_results 2>&1 | tee $checklog
 @[  end if]@
 @[  if is_ros2]@
-  if [ -f /usr/ros/@(ros_distro)/setup.sh ]; then
-    source /usr/ros/@(ros_distro)/setup.sh
+  if [ -f @(install_space)/setup.sh ]; then
+    source @(install_space)/setup.sh
   fi
 @[  end if]@
 @[  if use_ament_cmake or use_ament_python]@
-  export PYTHONPATH="$builddir"/tmp/pkg/usr/ros/@(ros_distro)/lib/python${PYTHON_VERSION}/site-packages:${PYTHONPATH}
-  export AMENT_PREFIX_PATH="$builddir"/tmp/pkg/usr/ros/@(ros_distro):${AMENT_PREFIX_PATH}
-  export PATH="$builddir"/tmp/pkg/usr/ros/@(ros_distro)/bin:${PATH}
-  export LD_LIBRARY_PATH="$builddir"/tmp/pkg/usr/ros/@(ros_distro)/lib:${LD_LIBRARY_PATH}
+  export PYTHONPATH="$builddir"/tmp/pkg@(install_space)/lib/python${PYTHON_VERSION}/site-packages:${PYTHONPATH}
+  export AMENT_PREFIX_PATH="$builddir"/tmp/pkg@(install_space):${AMENT_PREFIX_PATH}
+  export PATH="$builddir"/tmp/pkg@(install_space)/bin:${PATH}
+  export LD_LIBRARY_PATH="$builddir"/tmp/pkg@(install_space)/lib:${LD_LIBRARY_PATH}
   mkdir -p "$builddir"/tmp/pkg
 @[  end if]@
-@[  if use_cmake or use_ament_cmake]@
+@[  if use_any_cmake]@
   cd build
 @[  if use_ament_cmake]@
   make install DESTDIR="$builddir"/tmp/pkg
@@ -181,7 +181,7 @@ check() {
     --build-base="$builddir"/tmp/build \
     install \
     --root="$builddir"/tmp/pkg \
-    --prefix=/usr/ros/@(ros_distro) 2>&1 | tee $buildlog
+    --prefix=@(install_space) 2>&1 | tee $buildlog
   TEST_TARGET=$(ls -d */ | grep -m1 "\(test\|tests\)") || true
   if [ -z "$TEST_TARGET" ]; then
     echo "No \"test\" or \"tests\" directory. Check skipped" | tee $checklog
@@ -211,27 +211,27 @@ package() {
 @[end if]@
 
 @[if use_catkin]@
-  source /usr/ros/@(ros_distro)/setup.sh
+  source @(install_space)/setup.sh
   catkin_make_isolated \
     -DCMAKE_BUILD_TYPE=RelWithDebInfo \
-    --install-space /usr/ros/@(ros_distro)
+    --install-space @(install_space)
   catkin_make_isolated \
     -DCMAKE_BUILD_TYPE=RelWithDebInfo \
-    --install --install-space /usr/ros/@(ros_distro)
+    --install --install-space @(install_space)
   rm -f \
-    "$pkgdir"/usr/ros/@(ros_distro)/setup.* \
-    "$pkgdir"/usr/ros/@(ros_distro)/local_setup.* \
-    "$pkgdir"/usr/ros/@(ros_distro)/.rosinstall \
-    "$pkgdir"/usr/ros/@(ros_distro)/_setup_util.py \
-    "$pkgdir"/usr/ros/@(ros_distro)/env.sh \
-    "$pkgdir"/usr/ros/@(ros_distro)/.catkin
+    "$pkgdir"@(install_space)/setup.* \
+    "$pkgdir"@(install_space)/local_setup.* \
+    "$pkgdir"@(install_space)/.rosinstall \
+    "$pkgdir"@(install_space)/_setup_util.py \
+    "$pkgdir"@(install_space)/env.sh \
+    "$pkgdir"@(install_space)/.catkin
 @[end if]@
 @[if is_ros2]@
-  if [ -f /usr/ros/@(ros_distro)/setup.sh ]; then
-    source /usr/ros/@(ros_distro)/setup.sh
+  if [ -f @(install_space)/setup.sh ]; then
+    source @(install_space)/setup.sh
   fi
 @[end if]@
-@[if use_cmake or use_ament_cmake]@
+@[if use_any_cmake]@
   cd build
   make install
 @[end if]@
@@ -242,7 +242,7 @@ package() {
     --build-base="$builddir"/tmp/build \
     install \
     --root="$pkgdir" \
-    --prefix=/usr/ros/@(ros_distro)
+    --prefix=@(install_space)
 @[end if]@
 
   # Tweak invalid RPATH
@@ -300,7 +300,7 @@ package() {
       # Omit files under hidden directory
       continue
     fi
-@[if use_cmake or use_ament_cmake]@
+@[if use_any_cmake]@
     if echo $file | grep -e '^\./build/'; then
       # Omit files under build directory
       continue
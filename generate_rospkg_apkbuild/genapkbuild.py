@@ -27,20 +27,18 @@
 
 from __future__ import print_function
 from io import StringIO
+from itertools import chain
 import argparse
-import em
+import functools
 import os
 import subprocess
 import sys
-import yaml
 import re
 import json
 
-from catkin_pkg.package import Dependency, parse_package_string
-from rosdistro import get_cached_distribution, get_index, get_index_url
-from rosdistro.manifest_provider import get_release_tag
-from rosinstall_generator.generator import generate_rosinstall, get_wet_distro
-import rosdep2
+# Heavy third-party modules (catkin_pkg, rosdep2, rosdistro,
+# rosinstall_generator, em, yaml, requests) are imported lazily inside the
+# functions using them, to keep CLI startup (e.g. --help) fast.
 
 
 class NameAndVersion:
@@ -82,60 +80,221 @@ def ros_dependency_to_name_ver(dep):
     return NameAndVersion(dep.name, version_spec)
 
 
+@functools.lru_cache(maxsize=None)
+def get_distro(distro_name):
+    from rosinstall_generator.generator import get_wet_distro
+
+    return get_wet_distro(distro_name)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_index():
+    from rosdistro import get_index, get_index_url
+
+    return get_index(get_index_url())
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_package_string_cached(pkg_xml):
+    from catkin_pkg.package import parse_package_string
+
+    return parse_package_string(pkg_xml)
+
+
+def ros_dependencies_to_name_vers(*dep_lists):
+    # Dict keyed on (name, version spec) for order-preserving deduplication;
+    # duplicated entries would be re-resolved by the rosdep resolver otherwise.
+    deps = dict()
+    for nv in (ros_dependency_to_name_ver(dep) for dep in chain(*dep_lists)):
+        if nv is not None:
+            deps[(nv.name, nv.version)] = nv
+    return deps
+
+
+# Overridden by --rosdep-cache-dir; must be set before the first resolve
+_rosdep_sources_cache_dir = None
+
+
+def set_rosdep_sources_cache_dir(path):
+    global _rosdep_sources_cache_dir
+    _rosdep_sources_cache_dir = path
+
+
+@functools.lru_cache(maxsize=1)
 def load_lookup():
+    import rosdep2
+
+    sources_cache_dir = _rosdep_sources_cache_dir
+    if sources_cache_dir is None:
+        sources_cache_dir = rosdep2.sources_list.get_sources_cache_dir()
     sources_loader = rosdep2.sources_list.SourcesListLoader.create_default(
-        sources_cache_dir=rosdep2.sources_list.get_sources_cache_dir())
+        sources_cache_dir=sources_cache_dir)
     lookup = rosdep2.RosdepLookup.create_from_rospkg(sources_loader=sources_loader)
 
     return lookup
 
 
-def resolve(ros_distro, package_name, deps, add_ros_dev=False):
-    lookup = load_lookup()
+@functools.lru_cache(maxsize=1)
+def _get_installer_ctx():
+    import rosdep2
+
     installer_context = rosdep2.create_default_installer_context()
     os_name, os_version = installer_context.get_os_name_and_version()
     installer_keys = installer_context.get_os_installer_keys(os_name)
     default_key = installer_context.get_default_os_installer_key(os_name)
 
-    keys = []
-    not_provided = []
-    for dep in deps:
-        if dep is None:
-            continue
+    return installer_context, os_name, os_version, installer_keys, default_key
+
+
+@functools.lru_cache(maxsize=1)
+def _get_default_view():
+    import rosdep2
 
-        view = lookup.get_rosdep_view(rosdep2.rospkg_loader.DEFAULT_VIEW_KEY)
+    return load_lookup().get_rosdep_view(rosdep2.rospkg_loader.DEFAULT_VIEW_KEY)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_known_rosdep_keys():
+    return frozenset(_get_default_view().keys())
+
+
+# Bump on changes of the resolve cache entry format to invalidate old caches.
+_RESOLVE_CACHE_SCHEMA = 1
+_resolve_cache = None
+
+
+def _resolve_cache_file():
+    return os.path.join(
+        os.path.expanduser('~'), '.cache', 'ros-abuild', 'rosdep_resolve.json')
+
+
+def _load_resolve_cache():
+    global _resolve_cache
+    if _resolve_cache is None:
+        _resolve_cache = {}
         try:
-            d = view.lookup(dep.name)
-        except KeyError as e:
-            keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + dep.version)
-            if add_ros_dev:
-                keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + '-dev' + dep.version)
+            with open(_resolve_cache_file(), 'r') as f:
+                data = json.load(f)
+            if data.get('schema') == _RESOLVE_CACHE_SCHEMA:
+                _resolve_cache = data.get('entries', {})
+        except (IOError, OSError, ValueError):
+            pass
+    return _resolve_cache
+
+
+def _save_resolve_cache():
+    path = _resolve_cache_file()
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        tmppath = path + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump({'schema': _RESOLVE_CACHE_SCHEMA, 'entries': _resolve_cache}, f)
+        os.rename(tmppath, path)
+    except (IOError, OSError):
+        pass
+
+
+def _resolve_names(rosdep_names):
+    import rosdep2
+
+    installer_context, os_name, os_version, installer_keys, default_key = _get_installer_ctx()
+    view = _get_default_view()
+
+    entries = dict()
+    buckets = dict()
+    known = _get_known_rosdep_keys()
+    for name in rosdep_names:
+        # ROS package names are not rosdep keys; a set membership test is much
+        # cheaper than catching KeyError from view.lookup() per name.
+        if name not in known:
+            entries[name] = {'status': 'ros'}
             continue
+        d = view.lookup(name)
         try:
             rule_installer, rule = d.get_rule_for_platform(os_name, os_version, installer_keys, default_key)
         except rosdep2.lookup.ResolutionError as e:
             # ignoring ROS packages since Alpine ROS packages are not solvable at now
             if '_is_ros' in e.rosdep_data and e.rosdep_data['_is_ros']:
-                keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + dep.version)
-                if add_ros_dev:
-                    keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + "-dev" + dep.version)
-                continue
-            not_provided.append(dep.name)
+                entries[name] = {'status': 'ros'}
+            else:
+                entries[name] = {'status': 'not_provided'}
             continue
+        buckets.setdefault(rule_installer, []).append((name, d, rule))
+
+    for rule_installer, rules in buckets.items():
         installer = installer_context.get_installer(rule_installer)
-        resolved = installer.resolve(rule)
-        for r in resolved:
-            keys.append(r + dep.version)
-        if add_ros_dev:
-            if '_is_ros' in d.data and d.data['_is_ros']:
-                for r in resolved:
-                    keys.append(r + '-dev' + dep.version)
+        for name, d, rule in rules:
+            entries[name] = {
+                'status': 'resolved',
+                'resolved': list(installer.resolve(rule)),
+                'is_ros': bool('_is_ros' in d.data and d.data['_is_ros']),
+            }
+    return entries
+
+
+def resolve_groups(ros_distro, package_name, groups, add_ros_dev=False):
+    installer_context, os_name, os_version, installer_keys, default_key = _get_installer_ctx()
+    cache = _load_resolve_cache()
+
+    pending = dict()
+    for deps in groups.values():
+        for dep in deps:
+            if dep is None:
+                continue
+            cache_key = '|'.join([os_name, os_version, dep.name])
+            if cache_key not in cache:
+                pending[dep.name] = cache_key
+    if len(pending) > 0:
+        entries = _resolve_names(list(pending))
+        for name, cache_key in pending.items():
+            cache[cache_key] = entries[name]
+        _save_resolve_cache()
+
+    group_keys = dict()
+    not_provided = []
+    for group, deps in groups.items():
+        keys = []
+        for dep in deps:
+            if dep is None:
+                continue
+
+            entry = cache['|'.join([os_name, os_version, dep.name])]
+            if entry['status'] == 'ros':
+                keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + dep.version)
+                if add_ros_dev:
+                    keys.append(ros_pkgname_to_pkgname(ros_distro, dep.name) + '-dev' + dep.version)
+            elif entry['status'] == 'not_provided':
+                not_provided.append(dep.name)
+            else:
+                for r in entry['resolved']:
+                    keys.append(r + dep.version)
+                if add_ros_dev and entry['is_ros']:
+                    for r in entry['resolved']:
+                        keys.append(r + '-dev' + dep.version)
+        group_keys[group] = keys
 
     if len(not_provided) > 0:
         print('Some packages are not provided by the native installer for ' + package_name +
               ': ' + ' '.join(not_provided), file=sys.stderr)
         return None
-    return keys
+    return group_keys
+
+
+def resolve(ros_distro, package_name, deps, add_ros_dev=False):
+    group_keys = resolve_groups(
+        ros_distro, package_name, {'deps': deps}, add_ros_dev=add_ros_dev)
+    if group_keys is None:
+        return None
+    return group_keys['deps']
+
+
+@functools.lru_cache(maxsize=1)
+def _load_apkbuild_template():
+    template_path = os.path.join(os.path.dirname(__file__), 'APKBUILD.em.sh')
+    with open(template_path, 'r') as f:
+        return f.read()
 
 
 def force_py3_keys(keys):
@@ -176,27 +335,75 @@ def is_not_dev(key):
     return not is_dev(key)
 
 
+@functools.lru_cache(maxsize=1)
+def _http_session():
+    import requests
+
+    try:
+        import requests_cache
+        session = requests_cache.CachedSession(
+            cache_name=os.path.join(
+                os.path.expanduser('~'), '.cache', 'ros-abuild', 'http_cache'),
+            backend='sqlite', expire_after=3600, cache_control=True)
+    except ImportError:
+        session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_package_xml(ros_distro, package_name):
+    if package_name.startswith(('http://', 'https://')):
+        res = _http_session().get(package_name, timeout=10)
+        res.raise_for_status()
+        # package.xml is UTF-8 per REP-127; decode explicitly instead of
+        # res.text, which runs the slow apparent-encoding detection.
+        return res.content.decode('utf-8')
+    if package_name.endswith('.xml'):
+        with open(package_name, 'r') as f:
+            return f.read()
+    distro = get_distro(ros_distro)
+    return distro.get_release_package_xml(package_name)
+
+
+def packages_to_apkbuild(ros_distro, package_names, **kwargs):
+    from concurrent.futures import ThreadPoolExecutor
+
+    if any(not (name.startswith(('http://', 'https://')) or
+                name.endswith('.xml')) for name in package_names):
+        # Load the distro once before hitting it from worker threads
+        get_distro(ros_distro)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        pkg_xmls = list(executor.map(
+            lambda name: fetch_package_xml(ros_distro, name), package_names))
+
+    apkbuilds = dict()
+    for package_name, pkg_xml in zip(package_names, pkg_xmls):
+        apkbuilds[package_name] = package_to_apkbuild(
+            ros_distro, package_name, pkg_xml=pkg_xml, **kwargs)
+    return apkbuilds
+
+
 def package_to_apkbuild(ros_distro, package_name,
                         check=True, upstream=False, src=False, revfn=static_revfn(0),
-                        ver_suffix=None, commit_hash=None, split_dev=False):
-    pkg_xml = ''
+                        ver_suffix=None, commit_hash=None, split_dev=False,
+                        pkg_xml=None, output=None):
+    import em
+    import yaml
+    from rosinstall_generator.generator import generate_rosinstall
+
     todo_upstream_clone = dict()
     ros_python_version = os.environ["ROS_PYTHON_VERSION"]
 
-    if package_name.startswith('http://') or package_name.startswith('https://'):
-        import requests
-
-        res = requests.get(package_name)
-        pkg_xml = res.text
-    elif package_name.endswith('.xml'):
-        with open(package_name, 'r') as f:
-            pkg_xml = f.read()
-    else:
-        distro = get_wet_distro(ros_distro)
-        pkg_xml = distro.get_release_package_xml(package_name)
+    if pkg_xml is None:
+        pkg_xml = fetch_package_xml(ros_distro, package_name)
+    if not (package_name.startswith(('http://', 'https://')) or
+            package_name.endswith('.xml')):
         if upstream:
             todo_upstream_clone['read_manifest'] = True
-    pkg = parse_package_string(pkg_xml)
+    pkg = _parse_package_string_cached(pkg_xml)
 
     # generate rosinstall
     rosinstall = None
@@ -235,7 +442,7 @@ def package_to_apkbuild(ros_distro, package_name,
                     for name in names:
                         if name == 'package.xml':
                             with open('/'.join([root, name]), 'r') as f:
-                                pkg_tmp = parse_package_string(f.read())
+                                pkg_tmp = _parse_package_string_cached(f.read())
                                 if pkg_tmp.name == target_name:
                                     pkg = pkg_tmp
                                     break
@@ -246,7 +453,7 @@ def package_to_apkbuild(ros_distro, package_name,
                     ver_suffix = '_git' + date
 
     ros2_distros = [
-        name for name, value in get_index(get_index_url()).distributions.items()
+        name for name, value in _get_index().distributions.items()
         if value.get("distribution_type") == "ros2"]
     is_ros2 = ros_distro in ros2_distros
 
@@ -258,25 +465,7 @@ def package_to_apkbuild(ros_distro, package_name,
 
     pkg.evaluate_conditions(os.environ)
 
-    depends = []
-    for dep in pkg.exec_depends:
-        depends.append(ros_dependency_to_name_ver(dep))
-    if is_ros2:
-        # ros_workspace is required to build most of ROS2 packages, but packages don't explicitly
-        # depends on ros_workspace. So it is added to the dependencies here.
-        # See https://github.com/ros-infrastructure/bloom/blob/1086547b02af00e1f19a244c7fdd6b0e0ec60d20/bloom/generators/rosdebian.py#L99
-        ros2_ros_workspaces_dependencies = ["ament_cmake_core", "ament_package", "ros_workspace"]
-        if pkg.name not in ros2_ros_workspaces_dependencies:
-            depends.append(NameAndVersion("ros_workspace", ""))
-    depends_keys = resolve(ros_distro, package_name, depends, add_ros_dev=split_dev)
-
-    depends_export = []
-    for dep in pkg.buildtool_export_depends:
-        depends_export.append(ros_dependency_to_name_ver(dep))
-    for dep in pkg.build_export_depends:
-        depends_export.append(ros_dependency_to_name_ver(dep))
-    depends_export_keys = resolve(ros_distro, package_name, depends_export, add_ros_dev=split_dev)
-
+    # Validate the build type before any resolve() work to fail fast
     catkin = False
     cmake = False
     ament_cmake = False
@@ -306,17 +495,35 @@ def package_to_apkbuild(ros_distro, package_name,
             print('Un-supported build type for ROS1 package', file=sys.stderr)
             sys.exit(1)
 
-    makedepends = []
-    for dep in pkg.buildtool_depends:
-        makedepends.append(ros_dependency_to_name_ver(dep))
-    for dep in pkg.build_depends:
-        makedepends.append(ros_dependency_to_name_ver(dep))
-    for dep in pkg.test_depends:
-        makedepends.append(ros_dependency_to_name_ver(dep))
-    makedepends_keys = resolve(ros_distro, package_name, makedepends, add_ros_dev=split_dev)
-
-    if depends_keys is None or depends_export_keys is None or makedepends_keys is None:
+    depends = ros_dependencies_to_name_vers(pkg.exec_depends)
+    if is_ros2:
+        # ros_workspace is required to build most of ROS2 packages, but packages don't explicitly
+        # depends on ros_workspace. So it is added to the dependencies here.
+        # See https://github.com/ros-infrastructure/bloom/blob/1086547b02af00e1f19a244c7fdd6b0e0ec60d20/bloom/generators/rosdebian.py#L99
+        ros2_ros_workspaces_dependencies = ["ament_cmake_core", "ament_package", "ros_workspace"]
+        if pkg.name not in ros2_ros_workspaces_dependencies:
+            depends[("ros_workspace", "")] = NameAndVersion("ros_workspace", "")
+
+    depends_export = ros_dependencies_to_name_vers(
+        pkg.buildtool_export_depends, pkg.build_export_depends)
+
+    makedepends = ros_dependencies_to_name_vers(
+        pkg.buildtool_depends, pkg.build_depends, pkg.test_depends)
+
+    # Resolve all dependency groups in a single pass
+    group_keys = resolve_groups(
+        ros_distro, package_name,
+        {
+            'depends': list(depends.values()),
+            'depends_export': list(depends_export.values()),
+            'makedepends': list(makedepends.values()),
+        },
+        add_ros_dev=split_dev)
+    if group_keys is None:
         sys.exit(1)
+    depends_keys = group_keys['depends']
+    depends_export_keys = group_keys['depends_export']
+    makedepends_keys = group_keys['makedepends']
 
     # Remove duplicated dependency keys
     depends_keys = sorted(list(set(depends_keys)))
@@ -367,6 +574,7 @@ def package_to_apkbuild(ros_distro, package_name,
         'pkgver': pkg.version + ver_suffix,
         'pkgrel': revfn(pkg.version + ver_suffix),
         'ros_distro': ros_distro,
+        'install_space': '/usr/ros/' + ros_distro,
         'url': url,
         'license': pkg.licenses[0],
         'check': check,
@@ -381,15 +589,19 @@ def package_to_apkbuild(ros_distro, package_name,
         'use_cmake': cmake,
         'use_ament_cmake': ament_cmake,
         'use_ament_python': ament_python,
+        'use_any_cmake': cmake or ament_cmake,
         'is_ros2': is_ros2,
         'split_dev': split_dev,
     }
-    template_path = os.path.join(os.path.dirname(__file__), 'APKBUILD.em.sh')
-    apkbuild = StringIO()
+    if output is None:
+        apkbuild = StringIO()
+    else:
+        # em.Interpreter.shutdown() closes its output stream; keep the caller's open
+        apkbuild = em.UncloseableFile(output)
     interpreter = em.Interpreter(output=apkbuild, globals=g)
-    interpreter.file(open(template_path))
+    interpreter.string(_load_apkbuild_template(), 'APKBUILD.em.sh')
     interpreter.flush()
-    apkbuild_str = apkbuild.getvalue()
+    apkbuild_str = apkbuild.getvalue() if output is None else None
     interpreter.shutdown()
 
     return apkbuild_str
@@ -429,14 +641,22 @@ def main():
     parser.add_argument('--split-dev', action='store_const',
                         const=True, default=False,
                         help='split -dev packages (default: False)')
+    parser.add_argument('--rosdep-cache-dir', dest='rosdep_cache_dir', type=str, default=None,
+                        help='rosdep sources cache directory (default: rosdep default) ' +
+                        '[note: point this at a persistently mounted directory to reuse ' +
+                        'the cache between CI runs.]')
     args = parser.parse_args()
 
-    print(package_to_apkbuild(args.ros_distro[0], args.package[0],
-                              check=args.check, upstream=args.upstream,
-                              src=args.src, revfn=static_revfn(args.rev),
-                              ver_suffix=args.vsuffix,
-                              commit_hash=args.commit,
-                              split_dev=args.split_dev))
+    if args.rosdep_cache_dir is not None:
+        set_rosdep_sources_cache_dir(args.rosdep_cache_dir)
+
+    package_to_apkbuild(args.ros_distro[0], args.package[0],
+                        check=args.check, upstream=args.upstream,
+                        src=args.src, revfn=static_revfn(args.rev),
+                        ver_suffix=args.vsuffix,
+                        commit_hash=args.commit,
+                        split_dev=args.split_dev,
+                        output=sys.stdout)
 
 
 def main_multi():
@@ -464,14 +684,21 @@ example:
     parser.add_argument('--split-dev', action='store_const',
                         const=True, default=False,
                         help='split -dev packages (default: False)')
+    parser.add_argument('--rosdep-cache-dir', dest='rosdep_cache_dir', type=str, default=None,
+                        help='rosdep sources cache directory (default: rosdep default) ' +
+                        '[note: point this at a persistently mounted directory to reuse ' +
+                        'the cache between CI runs.]')
     args = parser.parse_args()
 
+    if args.rosdep_cache_dir is not None:
+        set_rosdep_sources_cache_dir(args.rosdep_cache_dir)
+
     pkglist = None
     force_upstream = dict()
     upstream_ref = dict()
     ignore = dict()
     if args.all:
-        distro = get_wet_distro(args.ros_distro[0])
+        distro = get_distro(args.ros_distro[0])
         pkglist = []
         for pkgname, _ in distro._distribution_file.release_packages.items():
             pkglist.append(pkgname + ' ' + ros_pkgname_to_pkgname(args.ros_distro[0], pkgname) + '/APKBUILD')
@@ -518,6 +745,8 @@ example:
                 return prev_rev + 1
             return prev_rev
 
+        # Write after full generation not to truncate an existing APKBUILD
+        # when the generation aborts halfway.
         apkbuild = package_to_apkbuild(
             args.ros_distro[0], pkgname,
             upstream=(args.upstream or pkg_force_upstream),